@@ -1,124 +1,514 @@
 import json
-from typing import List, Dict, Any
+import hashlib
+from typing import List, Dict, Any, Callable, Optional, Tuple
 import os
-import requests
+import sys
+import asyncio
+import functools
+import logging
+import httpx
+from dotenv import load_dotenv
+# llm_cache lives in the repo's shared/ directory so every lab uses the same copy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../shared"))
+from llm_cache import ResponseCache
+
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+# Read once for every Reviewer in the process
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Tool results are re-sent on every later call of the tool loop, so keep them small
+READ_FILE_BUDGET = 4000  # chars
+HISTORY_BUDGET = 4000  # chars
+GREP_TOP_K = 40  # lines
+CONTEXT_TOKEN_BUDGET = 24_000  # estimated tokens across all messages
+
+_TOOL_INSTRUCTIONS = """Available tools:
+- read_file(file_path, start_line, end_line): Use this to see more context around a change.
+- grep_codebase(search_pattern): Use this to find definitions of functions or variables.
+- get_file_history(file_path): Use this to see past changes to a file.
+
+MANDATORY PROOF OF WORK: As part of the 'Golden Dataset Proof', you MUST call EACH of the following tools at least once before providing your final JSON findings:
+1. `read_file` (use '{filename}' as the file_path)
+2. `grep_codebase`
+3. `get_file_history` (use '{filename}' as the file_path)
+
+Failure to use all three tools will result in an incomplete review.
+"""
+
+_FINDING_FORMAT = """  {{
+    "file": "{filename}",
+    "line_number": 123,
+    "severity": "critical|warn|info",
+    "category": "security|style|logic|etc",
+    "description": "Short explanation"
+  }}"""
+
+SYSTEM_TMPL = """You are {name}. {persona}
+
+You will receive content from a file named '{filename}'.
+Your goal is to find issues and return them in a structured JSON format.
+
+""" + _TOOL_INSTRUCTIONS + """
+RESPONSE FORMAT:
+You must first provide your reasoning for calling tools if needed.
+Once you have used all three tools and gathered information, provide your findings as an ARRAY of JSON objects:
+[
+""" + _FINDING_FORMAT + """
+]
+
+If no issues are found, return an empty array [].
+Do not include any other text in the final response except the JSON array.
+"""
+
+_JOINT_HEADER = """You are a review panel made up of the following reviewers, each working from their own perspective:
+{personas}
+
+You will receive content from a file named '{filename}'.
+Your goal is for every reviewer to find issues and return them in a structured JSON format.
+"""
+
+_JOINT_FORMAT = """provide a single JSON OBJECT with exactly these keys: {keys}.
+Each key holds the ARRAY of findings from that reviewer, where each finding looks like:
+""" + _FINDING_FORMAT + """
+
+Use an empty array [] for a reviewer that found no issues.
+Do not include any other text in the final response except the JSON object.
+"""
+
+JOINT_SYSTEM_TMPL = _JOINT_HEADER + """Any reviewer may request tools; all reviewers share the results.
+
+""" + _TOOL_INSTRUCTIONS + """
+RESPONSE FORMAT:
+You must first provide your reasoning for calling tools if needed.
+Once you have used all three tools and gathered information, """ + _JOINT_FORMAT
+
+# Batch submissions can't run a tool loop, so the mandatory tool output is
+# included in the user message instead
+BATCH_SYSTEM_TMPL = _JOINT_HEADER + """The output of read_file, grep_codebase and get_file_history for '{filename}' is included after the content.
+
+RESPONSE FORMAT:
+Using the content and that context, """ + _JOINT_FORMAT
+
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+BATCH_PENDING_STATUSES = {"validating", "in_progress", "finalizing"}
+
+def cached_llm_call(call):
+    """Serves identical requests from the reviewer's ResponseCache.
+
+    The request body is serialized once here; its SHA256 is the cache key and
+    the same bytes are what the wrapped call sends.
+    """
+    @functools.wraps(call)
+    async def wrapper(self, messages, tools=None):
+        body = self._request_body(messages, tools)
+        if self.cache is None:
+            return await call(self, body)
+        key = hashlib.sha256(body).hexdigest()
+        message = self.cache.get(key)
+        if message is None:
+            message = await call(self, body)
+            self.cache.set(key, message)
+        return message
+    return wrapper
+
+async def _read_stream(response: httpx.Response) -> Dict[str, Any]:
+    """Rebuilds the assistant message from OpenRouter's SSE deltas, stopping at finish_reason."""
+    content = []
+    tool_calls = {}
+    async for line in response.aiter_lines():
+        # Skip keep-alive comments (": OPENROUTER PROCESSING") and blank separators
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        if "error" in chunk:
+            raise RuntimeError(f"OpenRouter stream error: {chunk['error'].get('message', chunk['error'])}")
+        choice = chunk["choices"][0]
+        delta = choice.get("delta") or {}
+
+        if delta.get("content"):
+            content.append(delta["content"])
+        for call in delta.get("tool_calls") or []:
+            slot = tool_calls.setdefault(call.get("index", 0), {
+                "id": None,
+                "type": "function",
+                "function": {"name": "", "arguments": ""}
+            })
+            if call.get("id"):
+                slot["id"] = call["id"]
+            function = call.get("function") or {}
+            slot["function"]["name"] += function.get("name") or ""
+            slot["function"]["arguments"] += function.get("arguments") or ""
+
+        if choice.get("finish_reason"):
+            break
+
+    message = {"role": "assistant", "content": "".join(content)}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    return message
+
+def _extract_json(content: str, kind: type = list, accept: Callable[[Any], bool] = None) -> Any:
+    """Returns the first JSON array (or object) in the text, tolerating prose and code fences around it.
+
+    `accept` lets the caller skip values that decode but aren't the answer,
+    e.g. an example object quoted in the model's reasoning.
+    """
+    opener = "[" if kind is list else "{"
+    decoder = json.JSONDecoder()
+    i = content.find(opener)
+    while i != -1:
+        try:
+            obj, _ = decoder.raw_decode(content, i)
+            if isinstance(obj, kind) and (accept is None or accept(obj)):
+                return obj
+        except json.JSONDecodeError:
+            pass
+        i = content.find(opener, i + 1)
+    return kind()
+
+def _truncate(value: Any, limit: int) -> str:
+    # Slice strings before anything else so a 10KB grep dump isn't copied just to log 100 chars
+    return value[:limit] if isinstance(value, str) else repr(value)[:limit]
+
+def _estimate_tokens(content: Any) -> int:
+    # ~4 chars per token; the models behind OpenRouter don't share one tokenizer anyway
+    if isinstance(content, list):
+        return sum(len(part.get("text", "")) for part in content) // 4
+    return len(content or "") // 4
+
+def _trim_tool_result(func_name: str, args: Dict[str, Any], result: str) -> str:
+    """Cuts a tool result down to what is worth re-sending on every later call."""
+    if func_name == "grep_codebase":
+        lines = result.splitlines()
+        if len(lines) <= GREP_TOP_K:
+            return result
+        # Rank by how early the pattern appears in the matched text (definitions
+        # and imports tend to start with it), then restore the original order
+        pattern = args.get("search_pattern", "")
+        def rank(i):
+            text = lines[i].split(":", 2)[-1]
+            pos = text.find(pattern)
+            return pos if pos != -1 else len(text)
+        keep = sorted(sorted(range(len(lines)), key=rank)[:GREP_TOP_K])
+        return "\n".join(lines[i] for i in keep) + f"\n... [{len(lines) - GREP_TOP_K} more matches omitted] ..."
+    budget = {"read_file": READ_FILE_BUDGET, "get_file_history": HISTORY_BUDGET}.get(func_name)
+    if budget and len(result) > budget:
+        return result[:budget] + "\n... [TRUNCATED TO FIT CONTEXT BUDGET] ..."
+    return result
+
+def _enforce_token_budget(messages: List[Dict[str, Any]]):
+    """Fits the conversation into CONTEXT_TOKEN_BUDGET.
+
+    Tool results from before the latest assistant turn are blanked oldest first.
+    The results the model is about to read are never dropped; if blanking isn't
+    enough, the prefetched read_file result (a copy of the content under review)
+    goes next, then the user content and those results are cut to fit.
+    """
+    total = sum(_estimate_tokens(message.get("content")) for message in messages)
+    last_turn = max((i for i, message in enumerate(messages) if message["role"] == "assistant"), default=-1)
+    for message in messages[:max(last_turn, 0)]:
+        if total <= CONTEXT_TOKEN_BUDGET:
+            return
+        if message["role"] == "tool":
+            # The message has to stay so its tool_call_id still has an answer
+            placeholder = "[Older tool result dropped to stay within the context budget]"
+            total += _estimate_tokens(placeholder) - _estimate_tokens(message["content"])
+            message["content"] = placeholder
+
+    for message in messages:
+        if total <= CONTEXT_TOKEN_BUDGET:
+            return
+        if message.get("tool_call_id") == "prefetch_read_file":
+            placeholder = "[read_file result dropped to stay within the context budget; the content under review is in the user message]"
+            total += _estimate_tokens(placeholder) - _estimate_tokens(message["content"])
+            message["content"] = placeholder
+
+    marker = "\n... [TRUNCATED TO FIT CONTEXT BUDGET] ..."
+    users = [message for message in messages if message["role"] == "user"]
+    latest = [message for message in messages[last_turn + 1:] if message["role"] == "tool"]
+    for message in users + latest:
+        if total <= CONTEXT_TOKEN_BUDGET:
+            return
+        content = message["content"]
+        if not isinstance(content, str):
+            continue
+        keep = max(0, len(content) - (total - CONTEXT_TOKEN_BUDGET) * 4 - len(marker))
+        if message["role"] == "user":
+            # The report would otherwise read like a review of the whole input
+            log.warning("Review input truncated from %d to %d chars to fit the context budget; findings only cover the start", len(content), keep)
+        message["content"] = content[:keep] + marker
+        total += _estimate_tokens(message["content"]) - _estimate_tokens(content)
+
+# (key, name, persona): the key names the persona's slot in the panel's JSON answer
+Persona = Tuple[str, str, str]
+
+def _format_joint(template: str, personas: List[Persona], filename: str) -> str:
+    return template.format(
+        personas="\n".join(f"- {key}: {name}. {persona}" for key, name, persona in personas),
+        keys=", ".join(f'"{key}"' for key, _, _ in personas),
+        filename=filename
+    )
+
+def _split_findings(content: Optional[str], personas: List[Persona]) -> Dict[str, List[Dict[str, Any]]]:
+    """Splits a joint response into per-persona finding lists, tagging each finding with its persona key."""
+    panel = _extract_json(content or "", dict, accept=lambda obj: any(key in obj for key, _, _ in personas))
+    return {
+        key: [dict(finding, persona=key) for finding in panel.get(key) or [] if isinstance(finding, dict)]
+        for key, _, _ in personas
+    }
+
+def make_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        # Limits must go on the transport; AsyncClient ignores them once a transport is passed
+        transport=httpx.AsyncHTTPTransport(
+            retries=3,
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+        ),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    )
 
 class Reviewer:
-    def __init__(self, name: str, persona: str, model: str = "google/gemini-2.0-flash-001"):
+    def __init__(self, name: str, persona: str, model: str = "google/gemini-2.0-flash-001", cache: ResponseCache = None, client: httpx.AsyncClient = None):
         self.name = name
         self.persona = persona
         self.model = model
-        self.api_key = os.getenv("OPENROUTER_API_KEY")
+        self.cache = cache
+        self.api_key = OPENROUTER_API_KEY
         self.base_url = "https://openrouter.ai/api/v1"
 
-    def _call_llm(self, messages: List[Dict[str, str]], tools: List[Dict[str, Any]] = None) -> Dict[str, Any]:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://github.com/nalyx27/aip444",
-            "X-Title": "AI Code Review Assignment"
-        }
-        
+        # Pass a shared client so all reviewers reuse the same keep-alive
+        # connections; otherwise each reviewer opens (and owns) its own pool
+        self._owns_client = client is None
+        self._client = client or make_client()
+
+    def _system_message(self, text: str) -> Dict[str, Any]:
+        # Anthropic models only reuse a cached prefix when it is marked explicitly;
+        # other providers cache byte-identical prefixes automatically
+        if self.model.startswith("anthropic/"):
+            return {
+                "role": "system",
+                "content": [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+            }
+        return {"role": "system", "content": text}
+
+    async def aclose(self):
+        if self._owns_client:
+            await self._client.aclose()
+
+    def _request_body(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]] = None) -> bytes:
         payload = {
             "model": self.model,
             "messages": messages,
             "temperature": 0.1,
+            "stream": True,
         }
+        body = json.dumps(payload)
         if tools:
-            payload["tools"] = tools
-            payload["tool_choice"] = "auto"
+            # tool_definitions never changes, so splice in its pre-serialized form
+            tools_json = _TOOLS_JSON if tools is tool_definitions else json.dumps(tools)
+            body = body[:-1] + ', "tools": ' + tools_json + ', "tool_choice": "auto"}'
+        return body.encode("utf-8")
 
-        response = requests.post(
-            f"{self.base_url}/chat/completions",
-            headers=headers,
-            json=payload
-        )
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]
-
-    def review(self, content: str, filename: str, mode: str, verbose: bool = False, tool_handler = None) -> List[Dict[str, Any]]:
-        if verbose:
-            print(f"[{self.name}] Starting review in {mode} mode for {filename}...", file=sys.stderr)
-
-        system_prompt = f"""You are {self.name}. {self.persona}
-
-        You will receive content from a file named '{filename}'.
-        Your goal is to find issues and return them in a structured JSON format.
-        
-        Available tools:
-        - read_file(file_path, start_line, end_line): Use this to see more context around a change.
-        - grep_codebase(search_pattern): Use this to find definitions of functions or variables.
-        - get_file_history(file_path): Use this to see past changes to a file.
-
-        MANDATORY PROOF OF WORK: As part of the 'Golden Dataset Proof', you MUST call EACH of the following tools at least once before providing your final JSON findings:
-        1. `read_file` (use '{filename}' as the file_path)
-        2. `grep_codebase`
-        3. `get_file_history` (use '{filename}' as the file_path)
-
-        Failure to use all three tools will result in an incomplete review.
-        
-        RESPONSE FORMAT:
-        You must first provide your reasoning for calling tools if needed.
-        Once you have used all three tools and gathered information, provide your findings as an ARRAY of JSON objects:
-        [
-          {{
-            "file": "{filename}",
-            "line_number": 123,
-            "severity": "critical|warn|info",
-            "category": "security|style|logic|etc",
-            "description": "Short explanation"
-          }}
+    @cached_llm_call
+    async def _call_llm(self, body: bytes) -> Dict[str, Any]:
+        """Sends a pre-serialized chat request; callers pass (messages, tools) through cached_llm_call."""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://github.com/nalyx27/aip444",
+            "X-Title": "AI Code Review Assignment"
+        }
+
+        url = f"{self.base_url}/chat/completions"
+        for attempt in range(4):
+            async with self._client.stream("POST", url, headers=headers, content=body) as response:
+                if response.status_code not in RETRY_STATUSES or attempt == 3:
+                    if response.is_error:
+                        await response.aread()
+                    response.raise_for_status()
+                    return await _read_stream(response)
+            await asyncio.sleep(0.3 * (2 ** attempt))
+
+    async def review(self, content: str, filename: str, mode: str, tool_handler = None) -> List[Dict[str, Any]]:
+        """Reviews as this reviewer's single persona; review.py uses joint_review, this is for one-persona callers."""
+        log.debug("[%s] Starting review in %s mode for %s...", self.name, mode, filename)
+
+        system_prompt = SYSTEM_TMPL.format(name=self.name, persona=self.persona, filename=filename)
+
+        messages = [
+            self._system_message(system_prompt),
+            {"role": "user", "content": f"Review this {mode} content from {filename}:\n\n{content}"}
         ]
-        
-        If no issues are found, return an empty array [].
-        Do not include any other text in the final response except the JSON array.
-        """
+
+        content = await self._tool_loop(messages, filename, tool_handler)
+        # Findings are objects; this skips bracketed prose like "lines [3, 4]" in the reasoning
+        return _extract_json(content or "", accept=lambda obj: all(isinstance(finding, dict) for finding in obj))
+
+    async def joint_review(self, content: str, filename: str, mode: str, personas: List[Persona], tool_handler = None) -> Dict[str, List[Dict[str, Any]]]:
+        """Reviews once on behalf of several personas, returning their findings keyed (and tagged) by persona key."""
+        log.debug("[%s] Starting joint review in %s mode for %s...", self.name, mode, filename)
 
         messages = [
-            {"role": "system", "content": system_prompt},
+            self._system_message(_format_joint(JOINT_SYSTEM_TMPL, personas, filename)),
             {"role": "user", "content": f"Review this {mode} content from {filename}:\n\n{content}"}
         ]
 
+        content = await self._tool_loop(messages, filename, tool_handler)
+        return _split_findings(content, personas)
+
+    async def batch_joint_review(self, jobs: List[Tuple[str, str, str]], personas: List[Persona], tool_handler = None, poll_interval: float = 30) -> Dict[str, Dict[str, Any]]:
+        """Runs a joint review for each (content, filename, mode) job through the OpenAI Batch API.
+
+        Batch requests are single-shot, so the mandatory tool output is gathered
+        up front and inlined. Returns the findings keyed by filename; a file whose
+        request failed maps to {"error": message} instead.
+        """
+        lines = []
+        for index, (content, filename, mode) in enumerate(jobs):
+            context = ""
+            if tool_handler:
+                results = (await self._prefetch_mandatory_tools(filename, tool_handler))[1:]
+                context = "\n\n".join(f"### {result['name']}\n{result['content']}" for result in results)
+            messages = [
+                {"role": "system", "content": _format_joint(BATCH_SYSTEM_TMPL, personas, filename)},
+                {"role": "user", "content": f"Review this {mode} content from {filename}:\n\n{content}\n\n## Context\n\n{context}"}
+            ]
+            lines.append(json.dumps({
+                "custom_id": str(index),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": self.model, "messages": messages, "temperature": 0.1}
+            }))
+
+        headers = {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
+
+        upload = await self._client.post(
+            f"{OPENAI_BASE_URL}/files",
+            headers=headers,
+            data={"purpose": "batch"},
+            files={"file": ("reviews.jsonl", "\n".join(lines).encode("utf-8"), "application/jsonl")}
+        )
+        upload.raise_for_status()
+
+        response = await self._client.post(
+            f"{OPENAI_BASE_URL}/batches",
+            headers=headers,
+            json={"input_file_id": upload.json()["id"], "endpoint": "/v1/chat/completions", "completion_window": "24h"}
+        )
+        response.raise_for_status()
+        batch = response.json()
+
+        while batch["status"] in BATCH_PENDING_STATUSES:
+            log.debug("[%s] Batch %s is %s...", self.name, batch["id"], batch["status"])
+            await asyncio.sleep(poll_interval)
+            response = await self._client.get(f"{OPENAI_BASE_URL}/batches/{batch['id']}", headers=headers)
+            response.raise_for_status()
+            batch = response.json()
+
+        if batch["status"] != "completed":
+            raise RuntimeError(f"Batch {batch['id']} ended with status '{batch['status']}'")
+
+        # A batch where every request failed completes with only an error file
+        results = {}
+        for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+            if not file_id:
+                continue
+            output = await self._client.get(f"{OPENAI_BASE_URL}/files/{file_id}/content", headers=headers)
+            output.raise_for_status()
+            for line in output.text.splitlines():
+                item = json.loads(line)
+                filename = jobs[int(item["custom_id"])][1]
+                response = item.get("response") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    error = item.get("error") or (response.get("body") or {}).get("error") or {}
+                    results[filename] = {"error": error.get("message") or f"Request failed with HTTP {response.get('status_code')}"}
+                    continue
+                message = response["body"]["choices"][0]["message"]
+                results[filename] = _split_findings(message.get("content"), personas)
+
+        # Never let a missing result pass for a clean review
+        return {filename: results.get(filename, {"error": "No result returned for this request"}) for _, filename, _ in jobs}
+
+    async def _tool_loop(self, messages: List[Dict[str, Any]], filename: str, tool_handler) -> Optional[str]:
+        """Runs the LLM until it stops calling tools and returns its final content (None if it never stops)."""
+        # The mandatory tools don't depend on the model's reasoning, so run them
+        # in parallel before the first call instead of one round-trip each
+        memo = {}
+        if tool_handler:
+            messages.extend(await self._prefetch_mandatory_tools(filename, tool_handler, memo))
+
         # Simplified tool loop (max 5 iterations)
         for _ in range(5):
-            message = self._call_llm(messages, tool_definitions)
+            _enforce_token_budget(messages)
+            message = await self._call_llm(messages, tool_definitions)
             
             if not message.get("tool_calls"):
-                # No more tool calls, attempt to extract JSON
-                try:
-                    # Look for JSON array in content
-                    content = message.get("content", "")
-                    # LLMs often wrap JSON in triple backticks
-                    start = content.find("[")
-                    end = content.rfind("]") + 1
-                    if start != -1 and end != 0:
-                        return json.loads(content[start:end])
-                    return []
-                except:
-                    return []
+                return message.get("content") or ""
 
             # Process tool calls
             messages.append(message)
-            for tool_call in message["tool_calls"]:
-                func_name = tool_call["function"]["name"]
-                args = json.loads(tool_call["function"]["arguments"])
-                
-                if verbose:
-                    print(f"[{self.name}] Calling tool {func_name}({args})...", file=sys.stderr)
-                
-                result = tool_handler(func_name, args)
-                
-                if verbose:
-                    print(f"[{self.name}] Tool returned: {str(result)[:100]}...", file=sys.stderr)
-                
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call["id"],
-                    "name": func_name,
-                    "content": str(result)
-                })
-
-        return []
+            messages.extend(await self._run_tool_calls(message["tool_calls"], tool_handler, memo))
+
+        return None
+
+    async def _run_tool_calls(self, tool_calls: List[Dict[str, Any]], tool_handler, memo: Dict[Tuple[str, str], "asyncio.Future"] = None) -> List[Dict[str, Any]]:
+        """Dispatches all tool calls of one assistant message concurrently, keeping their original order.
+
+        Calls already made in this session (same name and arguments) reuse the
+        earlier result from memo instead of running the tool again.
+        """
+        memo = {} if memo is None else memo
+
+        async def run(tool_call):
+            func_name = tool_call["function"]["name"]
+            args = json.loads(tool_call["function"]["arguments"])
+
+            key = (func_name, json.dumps(args, sort_keys=True))
+            if key in memo:
+                log.debug("[%s] Reusing result of %s(%s)", self.name, func_name, args)
+            else:
+                log.debug("[%s] Calling tool %s(%s)...", self.name, func_name, args)
+                # Store the task, not the result, so duplicates within one gather share it
+                memo[key] = asyncio.ensure_future(tool_handler(func_name, args))
+            result = await memo[key]
+
+            log.debug("[%s] Tool returned: %s...", self.name, _truncate(result, 100))
+
+            return {
+                "role": "tool",
+                "tool_call_id": tool_call["id"],
+                "name": func_name,
+                "content": _trim_tool_result(func_name, args, str(result))
+            }
+
+        return await asyncio.gather(*(run(tool_call) for tool_call in tool_calls))
+
+    async def _prefetch_mandatory_tools(self, filename: str, tool_handler, memo: Dict[Tuple[str, str], "asyncio.Future"] = None) -> List[Dict[str, Any]]:
+        """Runs the three mandatory tools up front and returns them as an assistant turn plus its tool results."""
+        module_name = os.path.splitext(os.path.basename(filename))[0]
+        calls = [
+            ("read_file", {"file_path": filename}),
+            ("grep_codebase", {"search_pattern": module_name}),
+            ("get_file_history", {"file_path": filename}),
+        ]
+        tool_calls = [
+            {
+                "id": f"prefetch_{func_name}",
+                "type": "function",
+                "function": {"name": func_name, "arguments": json.dumps(args)}
+            }
+            for func_name, args in calls
+        ]
+        results = await self._run_tool_calls(tool_calls, tool_handler, memo)
+        return [{"role": "assistant", "content": None, "tool_calls": tool_calls}, *results]
 
 tool_definitions = [
     {
@@ -155,11 +545,12 @@ tool_definitions = [
         "type": "function",
         "function": {
             "name": "get_file_history",
-            "description": "Get git history for a file",
+            "description": "Get git history for a file (commit subjects only unless include_diffs is true)",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "file_path": {"type": "string"}
+                    "file_path": {"type": "string"},
+                    "include_diffs": {"type": "boolean"}
                 },
                 "required": ["file_path"]
             }
@@ -167,4 +558,4 @@ tool_definitions = [
     }
 ]
 
-import sys # Needed for stderr in Reviewer.review
+_TOOLS_JSON = json.dumps(tool_definitions)
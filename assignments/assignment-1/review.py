@@ -1,39 +1,74 @@
 import argparse
-import subprocess
 import sys
 import os
 import json
 import asyncio
+import inspect
+import logging
 from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from tools import read_file, grep_codebase, get_file_history
-from agents import Reviewer
+from tools import read_file, grep_codebase, get_file_history, MAX_IO_THREADS
+from agents import Reviewer, make_client
+# llm_cache lives in the repo's shared/ directory so every lab uses the same copy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../shared"))
+from llm_cache import ResponseCache
 
 load_dotenv()
 
-async def run_reviewer(reviewer, content, filename, mode, verbose, tool_handler):
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, reviewer.review, content, filename, mode, verbose, tool_handler)
+log = logging.getLogger("review")
 
-def tool_handler(name, args):
-    if name == "read_file":
-        return read_file(**args)
-    elif name == "grep_codebase":
-        return grep_codebase(**args)
-    elif name == "get_file_history":
-        return get_file_history(**args)
-    return f"Error: Tool {name} not found."
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache.sqlite")
+
+_TOOLS = {
+    "read_file": read_file,
+    "grep_codebase": grep_codebase,
+    "get_file_history": get_file_history,
+}
+_SIGNATURES = {name: inspect.signature(func) for name, func in _TOOLS.items()}
+
+async def tool_handler(name, args):
+    tool = _TOOLS.get(name)
+    if tool is None:
+        return f"Error: Tool {name} not found."
+
+    # Reject bad arguments from the model before any file I/O or subprocess
+    try:
+        _SIGNATURES[name].bind(**args)
+    except TypeError as e:
+        return f"Error: Invalid arguments for {name}: {e}"
+
+    if asyncio.iscoroutinefunction(tool):
+        return await tool(**args)
+    return await asyncio.to_thread(tool, **args)
 
 async def main():
     parser = argparse.ArgumentParser(description="AI Code Review CLI Tool")
     parser.add_argument("--file", help="File to review")
     parser.add_argument("--verbose", action="store_true", help="Enable verbose logging")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the LLM instead of reusing cached responses")
+    parser.add_argument("--batch", nargs="+", metavar="FILE", help="Review FILEs through the OpenAI Batch API (half price, minutes-to-hours latency)")
+    parser.add_argument("--batch-model", default="gpt-4o-mini", help="OpenAI model used in --batch mode")
     args = parser.parse_args()
 
+    # Only our own loggers go to DEBUG; httpx/httpcore debug output is noise here
+    logging.basicConfig(level=logging.WARNING, format="%(message)s", stream=sys.stderr)
+    if args.verbose:
+        for name in ("review", "agents"):
+            logging.getLogger(name).setLevel(logging.DEBUG)
+
+    # Bound the threads used by asyncio.to_thread (read_file, grep fallback) so
+    # concurrent reviewers can't oversubscribe the machine
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=MAX_IO_THREADS)
+    )
+
     content = ""
     mode = ""
 
-    if args.file:
+    if args.batch:
+        # Each file becomes its own job in the batch below
+        mode = "File"
+    elif args.file:
         if not os.path.exists(args.file):
             print(f"Error: File '{args.file}' not found.")
             sys.exit(1)
@@ -43,8 +78,14 @@ async def main():
     else:
         # Git Mode
         try:
-            result = subprocess.run(["git", "diff", "--staged"], capture_output=True, text=True)
-            content = result.stdout.strip()
+            # Read raw bytes and decode once; text=True plus .strip() kept two full copies
+            proc = await asyncio.create_subprocess_exec(
+                "git", "diff", "--staged",
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+            )
+            stdout = await proc.stdout.read()
+            await proc.wait()
+            content = stdout.decode("utf-8", "replace").rstrip()
             if not content:
                 print("No staged changes to review.")
                 sys.exit(0)
@@ -53,39 +94,77 @@ async def main():
             print(f"Error checking git changes: {e}")
             sys.exit(1)
 
-    # Initialize Reviewers
-    security_auditor = Reviewer(
-        "Security Auditor", 
-        "Paranoid, strict, and unyielding. Treats every line of code as a potential vector for attack. Scans for vulnerabilities (SQL injection, XSS), hardcoded secrets, and missing permission checks."
-    )
-    maintainability_critic = Reviewer(
-        "Maintainability Critic",
-        "Obsessed with 'Clean Code', naming conventions, and the DRY principle. Hates messy formatting. Focuses on readability, function length, and refactoring."
+    cache = None if args.no_cache else ResponseCache(CACHE_PATH)
+    # One connection pool for every reviewer in the run
+    client = make_client()
+
+    # Both personas see identical content, so one panel call covers them
+    review_panel = Reviewer(
+        "Review Panel",
+        "A panel of independent reviewers sharing a single pass over the code.",
+        cache=cache,
+        client=client
     )
 
-    if args.verbose:
-        print(f"Running parallel reviews for {mode} mode...", file=sys.stderr)
+    personas = [
+        (
+            "security",
+            "Security Auditor",
+            "Paranoid, strict, and unyielding. Treats every line of code as a potential vector for attack. Scans for vulnerabilities (SQL injection, XSS), hardcoded secrets, and missing permission checks."
+        ),
+        (
+            "maintainability",
+            "Maintainability Critic",
+            "Obsessed with 'Clean Code', naming conventions, and the DRY principle. Hates messy formatting. Focuses on readability, function length, and refactoring."
+        ),
+    ]
+
+    if args.batch:
+        jobs = []
+        for path in args.batch:
+            if not os.path.exists(path):
+                print(f"Error: File '{path}' not found.")
+                sys.exit(1)
+            with open(path, 'r', encoding='utf-8') as f:
+                jobs.append((f.read(), path, mode))
+
+        # Batch submissions are single-shot and go to OpenAI rather than OpenRouter
+        batch_panel = Reviewer(review_panel.name, review_panel.persona, model=args.batch_model, client=client)
+        log.debug("Submitting %d files as a batch...", len(jobs))
+        findings = await batch_panel.batch_joint_review(jobs, personas, tool_handler)
+        print(json.dumps(findings, indent=2))
+
+        await client.aclose()
+        # A failed request must not read as "no issues" to CI
+        if any("error" in result for result in findings.values()):
+            sys.exit(1)
+        return
 
-    # Parallel Execution
-    results = await asyncio.gather(
-        run_reviewer(security_auditor, content, args.file or "staged_changes", mode, args.verbose, tool_handler),
-        run_reviewer(maintainability_critic, content, args.file or "staged_changes", mode, args.verbose, tool_handler)
+    log.debug("Running joint review for %s mode...", mode)
+
+    results = await review_panel.joint_review(
+        content,
+        args.file or "staged_changes",
+        mode,
+        personas,
+        tool_handler
     )
 
     # Structured findings
-    reviewer1_findings = results[0]
-    reviewer2_findings = results[1]
+    reviewer1_findings = results["security"]
+    reviewer2_findings = results["maintainability"]
 
-    if args.verbose:
-        print("\n[Security Auditor Findings]:", file=sys.stderr)
-        print(json.dumps(reviewer1_findings, indent=2), file=sys.stderr)
-        print("\n[Maintainability Critic Findings]:", file=sys.stderr)
-        print(json.dumps(reviewer2_findings, indent=2), file=sys.stderr)
+    # Only pay for the JSON dumps when someone is reading them
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("\n[Security Auditor Findings]:\n%s", json.dumps(reviewer1_findings, indent=2))
+        log.debug("\n[Maintainability Critic Findings]:\n%s", json.dumps(reviewer2_findings, indent=2))
 
     # Lead Dev Synthesis
     lead_dev = Reviewer(
         "Lead Developer",
-        "Extremely experienced, pragmatic, empathetic but firm. Goal: De-duplicate, filter hallucinations, resolve conflicts, and format into a clean Markdown report."
+        "Extremely experienced, pragmatic, empathetic but firm. Goal: De-duplicate, filter hallucinations, resolve conflicts, and format into a clean Markdown report.",
+        cache=cache,
+        client=client
     )
     
     synthesis_payload = f"""Here are the raw findings from two reviewers:
@@ -102,14 +181,15 @@ Filter out minor nits or hallucinations.
 Make it human-readable and professional.
 """
 
-    if args.verbose:
-        print("\n[Lead Developer] Synthesizing report...", file=sys.stderr)
+    log.debug("\n[Lead Developer] Synthesizing report...")
 
     # Lead dev doesn't use tools in this simplified implementation for synthesis
-    final_report_msg = lead_dev._call_llm([
+    final_report_msg = await lead_dev._call_llm([
         {"role": "system", "content": lead_dev.persona},
         {"role": "user", "content": synthesis_payload}
     ])
+
+    await client.aclose()
     
     print(final_report_msg.get("content", "Error generating report."))
 
@@ -1,6 +1,16 @@
 import os
-import subprocess
+import mmap
+import time
+import itertools
+import functools
+import asyncio
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared bound for blocking work: review.py sizes the to_thread executor with it,
+# and the grep fallback's file scans reuse one pool of the same size
+MAX_IO_THREADS = min(8, (os.cpu_count() or 1) * 2)
+_scan_pool = ThreadPoolExecutor(max_workers=MAX_IO_THREADS, thread_name_prefix="grep-scan")
 
 def read_file(file_path: str, start_line: int = None, end_line: int = None) -> str:
     """Reads a file from disk with optional line range and size limits."""
@@ -9,67 +19,161 @@ def read_file(file_path: str, start_line: int = None, end_line: int = None) -> s
     
     try:
         # Check file size to avoid token overflow (e.g., 1MB limit for safety)
-        if os.path.getsize(file_path) > 1_000_000:
+        stat = os.stat(file_path)
+        if stat.st_size > 1_000_000:
             return f"Error: File '{file_path}' is too large to read (limit 1MB)."
 
-        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-            lines = f.readlines()
-            
-            if start_line is not None and end_line is not None:
-                # 1-indexed to 0-indexed
-                content = "".join(lines[max(0, start_line-1):end_line])
-            else:
-                content = "".join(lines)
-                
-            # Final safety check on string length (approx tokens)
-            if len(content) > 50000:
-                return content[:50000] + "\n... [TRUNCATED DUE TO LENGTH] ..."
-            return content
+        # mtime/size are part of the cache key so an edited file is read again
+        return _read_file_cached(file_path, start_line, end_line, stat.st_mtime_ns, stat.st_size)
     except Exception as e:
         return f"Error reading file: {str(e)}"
 
-def grep_codebase(search_pattern: str) -> str:
+@functools.lru_cache(maxsize=256)
+def _read_file_cached(file_path: str, start_line: int, end_line: int, mtime_ns: int, size: int) -> str:
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        if start_line is not None and end_line is not None:
+            # 1-indexed to 0-indexed; islice stops reading once end_line is reached
+            content = "".join(itertools.islice(f, max(0, start_line-1), max(0, end_line)))
+        else:
+            # Read one char past the limit so we know whether to truncate
+            content = f.read(50001)
+            
+        # Final safety check on string length (approx tokens)
+        if len(content) > 50000:
+            return content[:50000] + "\n... [TRUNCATED DUE TO LENGTH] ..."
+        return content
+
+def _async_ttl_cache(key, ttl: float = 30, maxsize: int = 256):
+    """Memoizes an async tool for a short TTL, so repeated calls skip the subprocess."""
+    def decorator(func):
+        cache = {}
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            k = key(*args, **kwargs)
+            hit = cache.get(k)
+            if hit and time.monotonic() - hit[0] < ttl:
+                return hit[1]
+            result = await func(*args, **kwargs)
+            if len(cache) >= maxsize:
+                cache.pop(next(iter(cache)))
+            cache[k] = (time.monotonic(), result)
+            return result
+        return wrapper
+    return decorator
+
+# Resolve the search binary once instead of walking PATH on every call
+_EXE = shutil.which("rg") or shutil.which("grep")
+_IS_RG = bool(_EXE) and os.path.basename(_EXE).startswith("rg")
+if _IS_RG:
+    _GREP_ARGV = [_EXE, "--line-number"]
+elif _EXE:
+    _GREP_ARGV = [_EXE, "-r"]
+else:
+    _GREP_ARGV = None
+
+async def _run(cmd, timeout: float = 10, stderr=asyncio.subprocess.PIPE):
+    """Runs a subprocess without blocking the event loop and returns (returncode, stdout, stderr) as bytes."""
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=stderr)
+    try:
+        stdout, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    return proc.returncode, stdout, err or b""
+
+# The cwd mtime changes when top-level entries are added or removed; the TTL covers deeper edits
+@_async_ttl_cache(key=lambda search_pattern: (search_pattern, os.stat(".").st_mtime_ns))
+async def grep_codebase(search_pattern: str) -> str:
     """Recursively searches the codebase for a pattern. Uses ripgrep/grep if available, else a Python fallback."""
-    executable = shutil.which("rg") or shutil.which("grep")
-    
-    if executable:
-        cmd = [executable, "-r", search_pattern, "."]
-        if "rg" in executable:
-            cmd = [executable, "--line-number", search_pattern, "."]
+    if _GREP_ARGV:
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-            if result.stdout:
-                return result.stdout[:10000]
-        except:
+            _, stdout, _ = await _run([*_GREP_ARGV, search_pattern, "."], stderr=asyncio.subprocess.DEVNULL)
+            if stdout:
+                # Only decode what we actually return
+                return stdout[:10000].decode("utf-8", "replace")
+        except (OSError, asyncio.TimeoutError):
+            # Missing binary or a hung search; cancellation must still propagate
             pass
 
-    # Python Fallback
+    # The Python fallback is plain file I/O, keep it off the event loop
+    return await asyncio.to_thread(_python_grep, search_pattern)
+
+def _scan_file(path: str, pattern: bytes) -> list:
+    """Finds matching lines with mmap + bytes.find, only counting newlines up to each hit."""
+    matches = []
+    with open(path, "rb") as f:
+        # Skip binaries and empty files (mmap can't map zero bytes)
+        head = f.read(8192)
+        if not head or b"\0" in head:
+            return matches
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            lineno, counted = 1, 0
+            i = mm.find(pattern)
+            while i != -1:
+                start = mm.rfind(b"\n", 0, i) + 1
+                end = mm.find(b"\n", i)
+                if end == -1:
+                    end = len(mm)
+                lineno += mm[counted:start].count(b"\n")
+                counted = start
+                line = mm[start:end].decode("utf-8", "replace").strip()
+                matches.append(f"{path}:{lineno}:{line}")
+                if end >= len(mm):
+                    break
+                i = mm.find(pattern, end + 1)
+    return matches
+
+def _scan_one(path: str, pattern: bytes) -> list:
+    try:
+        return _scan_file(path, pattern)
+    except (OSError, ValueError):
+        # Unreadable files and mmap failures; anything else is a bug in _scan_file
+        return []
+
+def _python_grep(search_pattern: str) -> str:
+    pattern = search_pattern.encode("utf-8")
+    paths = [
+        os.path.join(root, file)
+        for root, _, files in os.walk(".")
+        for file in files
+        if file.endswith((".py", ".ts", ".js", ".md"))
+    ]
+
+    # File reads and bytes.find both release the GIL, so threads scale with disk
     matches = []
-    for root, _, files in os.walk("."):
-        for file in files:
-            if file.endswith((".py", ".ts", ".js", ".md")):
-                path = os.path.join(root, file)
-                try:
-                    with open(path, 'r', encoding='utf-8', errors='replace') as f:
-                        for i, line in enumerate(f, 1):
-                            if search_pattern in line:
-                                matches.append(f"{path}:{i}:{line.strip()}")
-                except:
-                    continue
+    length = 0
+    futures = [_scan_pool.submit(_scan_one, path, pattern) for path in paths]
+    try:
+        for future in futures:
+            file_matches = future.result()
+            matches.extend(file_matches)
+            length += sum(len(m) + 1 for m in file_matches)
+            if length > 10000:
+                break
+    finally:
+        # The pool is shared, so drop only this search's queued scans
+        for future in futures:
+            future.cancel()
     
     output = "\n".join(matches)
     if not output:
         return "No matches found."
     return output[:10000]
 
-def get_file_history(file_path: str) -> str:
-    """Gets recent git history for a file."""
+@_async_ttl_cache(key=lambda file_path, include_diffs=False: (file_path, include_diffs))
+async def get_file_history(file_path: str, include_diffs: bool = False) -> str:
+    """Gets recent git history for a file, as one line per commit unless diffs are requested."""
+    if include_diffs:
+        cmd = ["git", "log", "-p", "-n", "3", "--", file_path]
+    else:
+        cmd = ["git", "log", "-n", "3", "--date=short", "--format=%h %ad %an: %s", "--", file_path]
     try:
         # Check if file exists and is tracked
-        result = subprocess.run(["git", "log", "-p", "-n", "3", "--", file_path], 
-                               capture_output=True, text=True, timeout=10)
-        if result.returncode != 0:
-            return f"No history available (file is new or untracked). Error: {result.stderr.strip()}"
-        return result.stdout or "No history available (file is new or untracked)."
+        returncode, stdout, stderr = await _run(cmd)
+        if returncode != 0:
+            return f"No history available (file is new or untracked). Error: {stderr.decode('utf-8', 'replace').strip()}"
+        return stdout.decode("utf-8", "replace") or "No history available (file is new or untracked)."
     except Exception as e:
         return f"Error getting history: {str(e)}"
@@ -4,6 +4,9 @@ import subprocess
 from dotenv import load_dotenv, find_dotenv
 from openai import OpenAI
 import openai
+# llm_cache lives in the repo's shared/ directory so every lab uses the same copy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../shared"))
+from llm_cache import ResponseCache
 
 print("Git Scribe - Developed by Dylan Navarrete - 107901225")
 print("--------------------------------------------------------------")
@@ -19,18 +22,19 @@ if not OPENROUTER_API_KEY:
 
 # Detect creative mode
 is_creative = "--creative" in sys.argv
+# Creative output is meant to vary between runs, so it is never cached
+use_cache = not is_creative and "--no-cache" not in sys.argv
 
 # Get staged git diff
 try:
     result = subprocess.run(
         ["git", "diff", "--staged"],
-        capture_output=True,
-        text=True,
-        encoding="utf-8",
-        errors="replace",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
         check=True
     )
-    diff = result.stdout.strip()
+    # Decode the raw bytes once instead of text mode + strip() copying the diff twice
+    diff = result.stdout.decode("utf-8", "replace").rstrip()
 
     if not diff:
         print("❌ No staged changes found")
@@ -64,22 +68,31 @@ else:
         "(e.g., 'feat: add logging'). No explanation."
     )
 
+messages = [
+    {"role": "system", "content": system_prompt},
+    {"role": "user", "content": diff}
+]
+
+cache = ResponseCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache.sqlite")) if use_cache else None
+cache_key = ResponseCache.make_key(model=LLM_MODEL, temperature=temperature, messages=messages)
+commit_message = cache.get(cache_key) if cache else None
+
 # Call the LLM
-try:
-    response = client.chat.completions.create(
-        model=LLM_MODEL,
-        temperature=temperature,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": diff}
-        ]
-    )
-except openai.RateLimitError:
-    print(f"❌ Rate Limit Error: The model '{LLM_MODEL}' is currently rate limited.")
-    print("Please try again later or switch to a different model using the LLM_MODEL environment variable.")
-    sys.exit(1)
+if commit_message is None:
+    try:
+        response = client.chat.completions.create(
+            model=LLM_MODEL,
+            temperature=temperature,
+            messages=messages
+        )
+    except openai.RateLimitError:
+        print(f"❌ Rate Limit Error: The model '{LLM_MODEL}' is currently rate limited.")
+        print("Please try again later or switch to a different model using the LLM_MODEL environment variable.")
+        sys.exit(1)
 
-commit_message = response.choices[0].message.content.strip()
+    commit_message = response.choices[0].message.content.strip()
+    if cache:
+        cache.set(cache_key, commit_message)
 
 print("\n📝 Suggested Commit Message:\n")
 print(commit_message)
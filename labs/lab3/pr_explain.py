@@ -1,10 +1,17 @@
 from urllib.parse import urlparse
 import os
+import sys
+import json
+import shelve
 from dotenv import load_dotenv
 from openai import OpenAI
 import requests
+# llm_cache lives in the repo's shared/ directory so every lab uses the same copy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../shared"))
+from llm_cache import ResponseCache
 
 MAX_DIFF_LENGTH = 100_000
+HTTP_CACHE_PATH = os.path.join(os.path.dirname(__file__), ".http_cache")
 
 def parse_pr_url(pr_url: str):
     parsed = urlparse(pr_url)
@@ -20,15 +27,32 @@ def parse_pr_url(pr_url: str):
     owner, repo, _, number = parts
     return owner, repo, int(number)
 
+def cached_get(url: str, headers: dict = None):
+    """GET a URL with If-None-Match, returning the stored body when GitHub answers 304."""
+    headers = dict(headers or {})
+
+    with shelve.open(HTTP_CACHE_PATH) as store:
+        cached = store.get(url)
+        if cached:
+            headers["If-None-Match"] = cached["etag"]
+
+        response = requests.get(url, headers=headers)
+
+        if response.status_code == 304 and cached:
+            return 200, cached["body"]
+
+        if response.status_code == 200 and "ETag" in response.headers:
+            store[url] = {"etag": response.headers["ETag"], "body": response.text}
+
+        return response.status_code, response.text
+
 def fetch_diff(pr_url: str) -> str:
     diff_url = f"{pr_url}.diff"
-    response = requests.get(diff_url)
+    status, diff = cached_get(diff_url)
 
-    if response.status_code != 200:
+    if status != 200:
         raise RuntimeError("Failed to fetch diff")
 
-    diff = response.text
-
     if len(diff) > MAX_DIFF_LENGTH:
         print("⚠️ Diff too large, truncating")
         diff = diff[:MAX_DIFF_LENGTH] + "\n...[Diff Truncated]...\n"
@@ -44,10 +68,10 @@ def fetch_comments(owner: str, repo: str, pr_number: int):
         "X-GitHub-Api-Version": "2022-11-28",
     }
 
-    response = requests.get(url, headers=headers)
+    status, body = cached_get(url, headers)
 
-    if response.status_code != 200:
-        raise RuntimeError(f"GitHub API error: {response.status_code}")
+    if status != 200:
+        raise RuntimeError(f"GitHub API error: {status}")
 
     return [
         {
@@ -55,7 +79,7 @@ def fetch_comments(owner: str, repo: str, pr_number: int):
             "body": item["body"],
             "date": item["updated_at"]
         }
-        for item in response.json()
+        for item in json.loads(body)
     ]
 
 SYSTEM_PROMPT = """
@@ -130,18 +154,29 @@ if __name__ == "__main__":
         api_key=os.getenv("OPENROUTER_API_KEY"),
     )
 
-    completion = client.chat.completions.create(
-        model="google/gemini-2.0-flash-001",
-        messages=[
-            {
-                "role": "system",
-                "content": SYSTEM_PROMPT
-            },
-            {
-                "role": "user",
-                "content": user_prompt
-            }
-        ]
-    )
-    print(completion.choices[0].message.content)
+    model = "google/gemini-2.0-flash-001"
+    messages = [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": user_prompt
+        }
+    ]
+
+    cache = None if "--no-cache" in sys.argv else ResponseCache(os.path.join(os.path.dirname(__file__), ".llm_cache.sqlite"))
+    cache_key = ResponseCache.make_key(model=model, messages=messages)
+    answer = cache.get(cache_key) if cache else None
+
+    if answer is None:
+        completion = client.chat.completions.create(
+            model=model,
+            messages=messages
+        )
+        answer = completion.choices[0].message.content
+        if cache:
+            cache.set(cache_key, answer)
+    print(answer)
 
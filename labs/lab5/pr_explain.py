@@ -1,65 +1,125 @@
-from urllib.parse import urlparse
+import asyncio
 import os
+import re
+import sys
 from dotenv import load_dotenv
-from openai import OpenAI
-import requests
-from tools import get_github_file
+from openai import AsyncOpenAI
+from tools import get_github_file, cached_get, send_with_retry, send_authenticated, has_github_token, http_client
 import json
 
-MAX_DIFF_LENGTH = 100_000
+MODEL = "google/gemini-2.0-flash-001"
+MODEL_CONTEXT_TOKENS = 1_048_576
+RESPONSE_TOKENS = 8_192  # headroom left for the report itself
+# Diffs at or under both limits are self-contained enough to answer without tools
+SMALL_DIFF_BYTES = 8_000
+SMALL_DIFF_FILES = 3
 
-def parse_pr_url(pr_url: str):
-    parsed = urlparse(pr_url)
-
-    if parsed.scheme != "https" or parsed.netloc != "github.com":
-        raise ValueError("Not a valid GitHub URL")
+# github.com serves the .diff itself, so the REST media type is only sent to the API
+API_HEADERS = {
+    "Accept": "application/vnd.github+json",
+    "X-GitHub-Api-Version": "2022-11-28",
+}
 
-    parts = parsed.path.strip("/").split("/")
+# Also matches /files, /commits, trailing slashes, query strings and fragments
+_PR_RE = re.compile(r'^https://github\.com/([^/]+)/([^/]+)/pull/(\d+)(?:[/?#].*)?$')
 
-    if len(parts) != 4 or parts[2] != "pull":
+def parse_pr_url(pr_url: str):
+    m = _PR_RE.match(pr_url)
+    if not m:
         raise ValueError("Not a valid GitHub Pull Request URL")
+    return m.group(1), m.group(2), int(m.group(3))
 
-    owner, repo, _, number = parts
-    return owner, repo, int(number)
-
-def fetch_diff(pr_url: str) -> str:
+async def fetch_diff(pr_url: str, max_bytes: int = 32_000) -> str:
     diff_url = f"{pr_url}.diff"
-    response = requests.get(diff_url)
-
-    if response.status_code != 200:
-        raise RuntimeError("Failed to fetch diff")
-
-    diff = response.text
-
-    if len(diff) > MAX_DIFF_LENGTH:
+    # Stream so a multi-megabyte diff stops downloading once we have enough
+    response = await send_with_retry("GET", diff_url, stream=True)
+    try:
+        if response.status_code != 200:
+            raise RuntimeError("Failed to fetch diff")
+        raw = bytearray()
+        async for chunk in response.aiter_bytes():
+            raw += chunk
+            if len(raw) > max_bytes:
+                break
+    finally:
+        await response.aclose()
+
+    diff = raw[:max_bytes].decode("utf-8", errors="replace")
+
+    if len(raw) > max_bytes:
         print("⚠️ Diff too large, truncating")
-        diff = diff[:MAX_DIFF_LENGTH] + "\n...[Diff Truncated]...\n"
+        diff += "\n...[Diff Truncated]...\n"
 
     return diff
 
-def fetch_comments(owner: str, repo: str, pr_number: int):
-    url = f"https://api.github.com/repos/{owner}/{repo}/issues/{pr_number}/comments"
-
-    headers = {
-        "User-Agent": "AIP444-Lab-03",
-        "Accept": "application/vnd.github+json",
-        "X-GitHub-Api-Version": "2022-11-28",
-    }
-
-    response = requests.get(url, headers=headers)
-
-    if response.status_code != 200:
-        raise RuntimeError(f"GitHub API error: {response.status_code}")
-
+async def _read_comments(response):
+    """Parse the comments payload straight from bytes and keep only the fields the prompt uses."""
     return [
         {
             "username": item["user"]["login"],
             "body": item["body"],
             "date": item["updated_at"]
         }
-        for item in response.json()
+        for item in json.loads(await response.aread())
     ]
 
+async def fetch_comments(owner: str, repo: str, pr_number: int):
+    url = f"https://api.github.com/repos/{owner}/{repo}/issues/{pr_number}/comments"
+
+    # The store holds the projected list, so a 304 skips parsing entirely
+    status, comments = await cached_get(url, API_HEADERS, read=_read_comments, key=f"{url}#projected")
+
+    if status != 200:
+        raise RuntimeError(f"GitHub API error: {status}")
+
+    return comments
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+
+PR_QUERY = """
+query($owner: String!, $repo: String!, $number: Int!) {
+  repository(owner: $owner, name: $repo) {
+    pullRequest(number: $number) {
+      headRefOid
+      comments(first: 100) {
+        nodes { author { login } body updatedAt }
+      }
+    }
+  }
+}
+"""
+
+async def fetch_pr_graphql(owner: str, repo: str, pr_number: int):
+    """Fetches the PR comments and head commit in one GraphQL request (one rate-limit point)."""
+    # Same token pool and throttle as the REST calls, tracked against the graphql quota
+    response = await send_authenticated(
+        "POST",
+        GRAPHQL_URL,
+        resource="graphql",
+        json={"query": PR_QUERY, "variables": {"owner": owner, "repo": repo, "number": pr_number}},
+    )
+
+    if response.status_code != 200:
+        raise RuntimeError(f"GitHub GraphQL error: {response.status_code}")
+
+    data = response.json()
+    if data.get("errors"):
+        raise RuntimeError(f"GitHub GraphQL error: {data['errors'][0]['message']}")
+
+    pr = data["data"]["repository"]["pullRequest"]
+    return {
+        "head_sha": pr["headRefOid"],
+        "comments": [
+            {
+                # Deleted accounts come back with a null author
+                "username": (node["author"] or {}).get("login", "ghost"),
+                "body": node["body"],
+                "date": node["updatedAt"]
+            }
+            for node in pr["comments"]["nodes"]
+        ]
+    }
+
 SYSTEM_PROMPT = """
 You are a Principal Engineer reviewing a GitHub Pull Request.
 Your role is to help a junior developer understand both the technical changes and the human discussion around the PR.
@@ -108,26 +168,47 @@ Only fetch files that are directly relevant.
 When you use the tool, the content might be truncated. If you see "[File truncated...]", understand that you only have the beginning of the file. If the relevant code is likely at the end, you might not see it (currently the tool only fetches the top) - in that case, do your best with what you have or explain the limitation.
 """
 
-def build_user_prompt(diff: str, comments: list) -> str:
-    formatted_comments = "\n".join(
-        '<comment username="{username}" date="{date}">\n{body}\n</comment>'.format(
-            username=c["username"],
-            date=c["date"],
-            body=c["body"]
-        )
-        for c in comments
-    )
+def estimate_tokens(text: str) -> int:
+    # ~4 chars per token; OpenRouter models don't share one tokenizer, so tiktoken would be no more exact
+    return len(text) // 4
+
+# The system prompt never changes, so count it once at import
+SYSTEM_PROMPT_TOKENS = estimate_tokens(SYSTEM_PROMPT)
 
+def is_small_diff(diff: str) -> bool:
+    files = {line[6:] for line in diff.splitlines() if line.startswith("+++ b/")}
+    return len(files) <= SMALL_DIFF_FILES and len(diff.encode()) < SMALL_DIFF_BYTES
+
+def build_diff_prompt(diff: str) -> str:
     return (
         "### DIFF\n"
         "```diff\n"
         f"{diff}\n"
-        "```\n\n"
+        "```\n"
+    )
+
+def build_comments_prompt(comments: list) -> str:
+    formatted_comments = "\n".join([
+        f'<comment username="{c["username"]}" date="{c["date"]}">\n{c["body"]}\n</comment>'
+        for c in comments
+    ])
+
+    return (
         "<comments>\n"
         f"{formatted_comments}\n"
         "</comments>\n"
     )
 
+def cacheable_message(role: str, text: str) -> dict:
+    """
+    Build a message that is part of the stable prompt prefix. Anthropic models
+    only cache a prefix that is explicitly marked; OpenAI-style providers cache
+    byte-identical prefixes automatically, so those get a plain string.
+    """
+    if MODEL.startswith("anthropic/"):
+        return {"role": role, "content": [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]}
+    return {"role": role, "content": text}
+
 TOOLS = [
     {
         "type": "function",
@@ -161,7 +242,58 @@ TOOLS = [
     }
 ]
 
-if __name__ == "__main__":
+async def stream_completion(client, messages, tool_choice="auto"):
+    """
+    Stream one chat completion, printing content as it arrives, and return
+    the assembled assistant message (including any tool calls) as a dict.
+    """
+    stream = await client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        tools=TOOLS,
+        tool_choice=tool_choice,
+        stream=True
+    )
+
+    content = []
+    tool_calls = {}
+
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+
+        if delta.content:
+            if not content:
+                # Tool-call deltas can still follow, so this turn may not be the final answer
+                print("\n====== MODEL RESPONSE ======")
+            sys.stdout.write(delta.content)
+            sys.stdout.flush()
+            content.append(delta.content)
+
+        # Tool call arguments arrive in fragments, keyed by the call's index
+        for tc in delta.tool_calls or []:
+            slot = tool_calls.setdefault(tc.index, {
+                "id": None,
+                "type": "function",
+                "function": {"name": "", "arguments": ""}
+            })
+            if tc.id:
+                slot["id"] = tc.id
+            if tc.function and tc.function.name:
+                slot["function"]["name"] += tc.function.name
+            if tc.function and tc.function.arguments:
+                slot["function"]["arguments"] += tc.function.arguments
+
+    if content:
+        print()
+
+    message = {"role": "assistant", "content": "".join(content) or None}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+    return message
+
+async def main():
     load_dotenv(os.path.join(os.path.dirname(__file__), '../../.env'))
     
     # Check for API key
@@ -174,8 +306,22 @@ if __name__ == "__main__":
     print(f"Analyzing PR: {pr_url}")
     try:
         owner, repo, number = parse_pr_url(pr_url)
-        diff = fetch_diff(pr_url)
-        comments = fetch_comments(owner, repo, number)
+        # Drop any /files or query suffix so fetch_diff can append .diff
+        pr_url = f"https://github.com/{owner}/{repo}/pull/{number}"
+        # The two fetches don't depend on each other, so overlap their round-trips
+        # GraphQL needs a token; without one, fall back to the REST comments endpoint
+        head_sha = None
+        if has_github_token():
+            diff, pr = await asyncio.gather(
+                fetch_diff(pr_url),
+                fetch_pr_graphql(owner, repo, number)
+            )
+            comments, head_sha = pr["comments"], pr["head_sha"]
+        else:
+            diff, comments = await asyncio.gather(
+                fetch_diff(pr_url),
+                fetch_comments(owner, repo, number)
+            )
     except Exception as e:
         print(f"❌ Error fetching PR data: {e}")
         exit(1)
@@ -183,21 +329,38 @@ if __name__ == "__main__":
     print("====== SYSTEM PROMPT ======")
     print(SYSTEM_PROMPT)
 
-    user_prompt = build_user_prompt(diff[:32000], comments)
-    user_prompt += "\n\nPlease fetch 'src/vs/platform/browserView/browser/browserViewService.ts' to understand the surrounding code of the changes."
+    # The diff gets its own message right after the system prompt so the cached
+    # prefix covers it; everything that varies goes in the message after it
+    diff_prompt = build_diff_prompt(diff)
+    user_prompt = build_comments_prompt(comments)
+    if head_sha:
+        # Lets the model pass the exact PR revision as `ref` to get_github_file
+        user_prompt += f"\n\nThe PR head commit is {head_sha}."
+    small_diff = is_small_diff(diff)
+    if not small_diff:
+        user_prompt += "\n\nPlease fetch 'src/vs/platform/browserView/browser/browserViewService.ts' to understand the surrounding code of the changes."
     print("\n====== USER PROMPT ======")
     print("User prompt built (showing first 500 chars):")
-    print(user_prompt[:500] + "...")
+    print((diff_prompt + "\n" + user_prompt)[:500] + "...")
+
+    # Don't spend a round-trip on a request the model is guaranteed to reject
+    prompt_tokens = SYSTEM_PROMPT_TOKENS + estimate_tokens(diff_prompt) + estimate_tokens(user_prompt)
+    if prompt_tokens > MODEL_CONTEXT_TOKENS - RESPONSE_TOKENS:
+        print(f"❌ Error: prompt is ~{prompt_tokens} tokens, over the {MODEL_CONTEXT_TOKENS}-token context of {MODEL}.")
+        exit(1)
 
     print("\n====== AGENT START ======")
     
-    client = OpenAI(
+    client = AsyncOpenAI(
         base_url="https://openrouter.ai/api/v1",
         api_key=os.getenv("OPENROUTER_API_KEY"),
     )
 
+    # Only ever append to messages: the first two entries are the cached prefix and
+    # must reach the provider byte-for-byte the same on every turn
     messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
+        cacheable_message("system", SYSTEM_PROMPT),
+        cacheable_message("user", diff_prompt),
         {"role": "user", "content": user_prompt}
     ]
 
@@ -208,47 +371,53 @@ if __name__ == "__main__":
         interaction_count += 1
         
         try:
-            response = client.chat.completions.create(
-                model="google/gemini-2.0-flash-001",
-                messages=messages,
-                tools=TOOLS,
-                tool_choice="auto"
-            )
+            # A small diff gets answered in one call instead of a speculative fetch first
+            tool_choice = "none" if small_diff and interaction_count == 1 else "auto"
+            message = await stream_completion(client, messages, tool_choice)
         except Exception as e:
             print(f"❌ Error calling LLM: {e}")
             break
 
-        message = response.choices[0].message
         messages.append(message) # Keep history
 
         # If the model wants to call a tool
-        if message.tool_calls:
-            for tool_call in message.tool_calls:
-                arguments = json.loads(tool_call.function.arguments)
-                print(f"\n🔧 TOOL CALL: {tool_call.function.name}")
-                print(f"   Args: {arguments}")
-
-                result = get_github_file(
-                    owner=arguments["owner"],
-                    repo=arguments["repo"],
-                    filepath=arguments["filepath"],
-                    ref=arguments.get("ref", "main")
+        if message.get("tool_calls"):
+            tool_calls = message["tool_calls"]
+            arguments = [json.loads(tc["function"]["arguments"]) for tc in tool_calls]
+            for tool_call, args in zip(tool_calls, arguments):
+                print(f"\n🔧 TOOL CALL: {tool_call['function']['name']}")
+                print(f"   Args: {args}")
+
+            # Fetch every requested file at once; results keep the original call order
+            results = await asyncio.gather(*[
+                get_github_file(
+                    owner=args["owner"],
+                    repo=args["repo"],
+                    filepath=args["filepath"],
+                    ref=args.get("ref", "main")
                 )
-                
+                for args in arguments
+            ])
+
+            for tool_call, result in zip(tool_calls, results):
                 # Truncate result for display if it's long
                 display_result = result[:200] + "..." if len(result) > 200 else result
-                print(f"   Result: {display_result}")
+                print(f"   Result ({tool_call['function']['name']}): {display_result}")
 
                 messages.append({
                     "role": "tool",
-                    "tool_call_id": tool_call.id,
+                    "tool_call_id": tool_call["id"],
                     "content": result
                 })
         else:
-            # No tool calls, this is the final answer
-            print("\n====== FINAL RESPONSE ======")
-            print(message.content)
+            # No tool calls: the final answer was already printed as it streamed
             break
     
     if interaction_count >= max_interactions:
         print("\n⚠️ Reached maximum interaction limit.")
+
+    await client.close()
+    await http_client.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
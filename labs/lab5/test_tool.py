@@ -1,16 +1,17 @@
+import asyncio
 from tools import get_github_file
 
 print("Starting test...")
 
-content = get_github_file(
+content = asyncio.run(get_github_file(
     "microsoft",
     "vscode",
     "package.json",
     "main"
-)
+))
 
 print("Response received.")
 print("Type:", type(content))
 print("Length:", len(content))
 print("Preview:")
-print(content[:500])
\ No newline at end of file
+print(content[:500])
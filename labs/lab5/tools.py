@@ -1,28 +1,213 @@
-import requests
+import asyncio
+import importlib.util
+import itertools
+import os
+import shelve
+import time
+import httpx
 
-def get_github_file(owner, repo, filepath, ref="main", max_lines=500):
+HTTP_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".http_cache")
+RETRY_STATUSES = {429, 502, 503, 504}
+STATUS_RETRIES = 2
+READ_RETRIES = 1
+MAX_RETRY_AFTER = 15  # a longer Retry-After fails fast instead of stalling the agent
+MIN_RATE_REMAINING = 10  # leave a token alone once it's this close to its hourly cap
+MAX_RPS = 10  # GitHub's secondary limits punish bursts even with quota left
+
+# One keep-alive client shared by every GitHub request in the process.
+# HTTP/2 multiplexes concurrent fetches over one connection but needs the
+# optional `h2` package (pip install "httpx[http2]"), so fall back to HTTP/1.1
+http_client = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_keepalive_connections=16),
+        retries=2,  # connection errors only
+    ),
+    headers={"User-Agent": "AIP444-Lab-05"},
+    # Bounds every GitHub request so a hung endpoint can't block the agent forever
+    timeout=httpx.Timeout(15, connect=3.05),
+    follow_redirects=True,  # github.com redirects .diff downloads to its CDN
+)
+
+def _retry_delay(response, attempt):
+    """Seconds to wait before retrying, honoring a numeric Retry-After; None to give up."""
+    retry_after = response.headers.get("Retry-After", "")
+    if not retry_after.isdigit():
+        return 0.2 * 2 ** attempt
+    delay = int(retry_after)
+    return delay if delay <= MAX_RETRY_AFTER else None
+
+async def send_with_retry(method, url, stream=False, **kwargs):
     """
-    Fetch raw file content from GitHub and truncate if too large.
+    Send a request on the shared client. GETs are retried on 429/502/503/504
+    and once on a read timeout; anything else is sent exactly once.
+    With stream=True the caller must `await response.aclose()`.
     """
+    retries = STATUS_RETRIES if method == "GET" else 0
+    read_retries = READ_RETRIES if method == "GET" else 0
+    attempt = 0
+    while True:
+        request = http_client.build_request(method, url, **kwargs)
+        try:
+            response = await http_client.send(request, stream=stream)
+        except httpx.ReadTimeout:
+            if not read_retries:
+                raise
+            read_retries -= 1
+            continue
 
-    url = f"https://raw.githubusercontent.com/{owner}/{repo}/{ref}/{filepath}"
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            return response
+        delay = _retry_delay(response, attempt)
+        if delay is None:
+            return response
+        await response.aclose()
+        await asyncio.sleep(delay)
+        attempt += 1
+
+_tokens = None
+_token_cycle = None
+_rate_limits = {}  # (token, resource) -> (remaining, reset epoch) from the last response
+_next_request_at = 0.0
+
+def _load_tokens():
+    global _tokens, _token_cycle
+    if _tokens is None:
+        # Read lazily so the caller's load_dotenv has run by the first request
+        raw = os.getenv("GITHUB_TOKENS") or os.getenv("GITHUB_TOKEN") or ""
+        _tokens = [t.strip() for t in raw.split(",") if t.strip()]
+        _token_cycle = itertools.cycle(_tokens)
+    return _tokens
+
+def has_github_token():
+    """True if GITHUB_TOKENS or GITHUB_TOKEN configured at least one token."""
+    return bool(_load_tokens())
+
+def _next_token(resource="core"):
+    """
+    Round-robin over GITHUB_TOKENS (comma-separated, falling back to GITHUB_TOKEN),
+    skipping tokens that are nearly out of quota for `resource` (GitHub counts
+    REST "core" and "graphql" separately). None means go unauthenticated.
+    """
+    tokens = _load_tokens()
+    for _ in range(len(tokens)):
+        token = next(_token_cycle)
+        remaining, reset = _rate_limits.get((token, resource), (MIN_RATE_REMAINING, 0))
+        if remaining >= MIN_RATE_REMAINING or time.time() >= reset:
+            return token
+    return None
+
+def _record_rate_limit(token, response):
+    if token and "X-RateLimit-Remaining" in response.headers:
+        resource = response.headers.get("X-RateLimit-Resource", "core")
+        _rate_limits[(token, resource)] = (
+            int(response.headers["X-RateLimit-Remaining"]),
+            int(response.headers.get("X-RateLimit-Reset", 0))
+        )
+
+async def _throttle():
+    """Space requests at least 1/MAX_RPS seconds apart."""
+    global _next_request_at
+    now = time.monotonic()
+    wait = _next_request_at - now
+    # Claim the slot before sleeping so concurrent callers queue up behind it
+    _next_request_at = max(now, _next_request_at) + 1 / MAX_RPS
+    if wait > 0:
+        await asyncio.sleep(wait)
 
+async def send_authenticated(method, url, resource="core", headers=None, **kwargs):
+    """
+    send_with_retry for GitHub: waits its turn under MAX_RPS, authenticates with
+    the next pooled token and records that token's rate-limit headers.
+    """
+    headers = dict(headers or {})
+    # Pick the token after waiting our turn so it reflects the latest rate-limit headers
+    await _throttle()
+    token = _next_token(resource)
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    response = await send_with_retry(method, url, headers=headers, **kwargs)
+    _record_rate_limit(token, response)
+    return response
+
+async def cached_get(url, headers=None, read=None, key=None):
+    """
+    GET a URL with If-None-Match / If-Modified-Since, returning (status, body).
+    A 304 returns the stored body; GitHub doesn't count it against the rate limit.
+
+    `read` is a coroutine that turns a 200 response into the body to return and
+    store (defaults to the full text), and `key` overrides the store key when
+    `read` is lossy.
+
+    Each call is rate-limited and authenticated with the next pooled token.
+    """
+    headers = dict(headers or {})
+    key = key or url
+
+    # Store access never awaits, so concurrent coroutines can't interleave inside it
+    with shelve.open(HTTP_CACHE_PATH) as store:
+        cached = store.get(key)
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = await send_authenticated("GET", url, stream=True, headers=headers)
     try:
-        response = requests.get(url)
+        if response.status_code == 304 and cached:
+            return 200, cached["body"]
 
-        if response.status_code == 404:
-            return f"Error: File not found: {url}"
+        if response.status_code != 200:
+            await response.aread()
+            return response.status_code, response.text
 
-        response.raise_for_status()
+        if read:
+            body = await read(response)
+        else:
+            await response.aread()
+            body = response.text
+        if "ETag" in response.headers or "Last-Modified" in response.headers:
+            with shelve.open(HTTP_CACHE_PATH) as store:
+                store[key] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "body": body
+                }
+        return 200, body
+    finally:
+        await response.aclose()
 
-        content = response.text
-        lines = content.splitlines()
+async def _read_lines(response, max_lines):
+    """Read at most max_lines lines off a streamed response, then stop downloading."""
+    lines = []
+    async for line in response.aiter_lines():
+        if len(lines) == max_lines:
+            return "\n".join(lines) + f"\n\n[File truncated: showing first {max_lines} lines, the file is longer]"
+        lines.append(line)
+    return "\n".join(lines)
+
+async def get_github_file(owner, repo, filepath, ref="main", max_lines=500):
+    """
+    Fetch raw file content from GitHub, reading no more than max_lines lines.
+    """
+
+    url = f"https://raw.githubusercontent.com/{owner}/{repo}/{ref}/{filepath}"
+
+    try:
+        status, content = await cached_get(
+            url,
+            read=lambda response: _read_lines(response, max_lines),
+            key=f"{url}#max_lines={max_lines}"
+        )
+
+        if status == 404:
+            return f"Error: File not found: {url}"
 
-        if len(lines) > max_lines:
-            truncated = "\n".join(lines[:max_lines])
-            return f"{truncated}\n\n[File truncated: showing first {max_lines} of {len(lines)} lines]"
+        if status >= 400:
+            return f"Error fetching file: HTTP {status} for {url}"
 
         return content
 
-    except requests.exceptions.RequestException as e:
-        return f"Error fetching file: {str(e)}"
\ No newline at end of file
+    except httpx.HTTPError as e:
+        return f"Error fetching file: {str(e)}"
@@ -0,0 +1,31 @@
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+from typing import Any, Optional
+
+DEFAULT_TTL = 7 * 24 * 60 * 60  # 7 days
+
+class ResponseCache:
+    """On-disk SQLite cache of LLM responses, keyed on a SHA256 of the request."""
+
+    def __init__(self, path: str, ttl: int = DEFAULT_TTL):
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache(key TEXT PRIMARY KEY, response BLOB, ts INTEGER)")
+
+    @staticmethod
+    def make_key(**request: Any) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn.execute("SELECT response, ts FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, key: str, response: Any):
+        blob = zlib.compress(json.dumps(response).encode())
+        self._conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, blob, int(time.time())))
+        self._conn.commit()